@@ -1,21 +1,46 @@
-from typing import Optional, Tuple
+from typing import Dict, Iterable, Optional, Tuple
+import atexit
+import logging
 import sqlite3
 import datetime
 
+LOGGER = logging.getLogger("CITESair_uploader")
+
+# Single connection shared by every helper below; opened lazily by _get_conn().
+_CONN: Optional[sqlite3.Connection] = None
+
+
+def _get_conn(db_path: str) -> sqlite3.Connection:
+    """Return the cached connection, opening it on first use."""
+    global _CONN
+    if _CONN is None:
+        _CONN = sqlite3.connect(db_path, check_same_thread=False)
+        # WAL turns each small commit into a sequential append instead of a
+        # rollback-journal rewrite; journal_mode persists in the DB file.
+        _CONN.execute("PRAGMA journal_mode=WAL")
+        _CONN.execute("PRAGMA synchronous=NORMAL")
+        _CONN.execute("PRAGMA wal_autocheckpoint=1000")
+        atexit.register(_CONN.close)
+    return _CONN
+
+
 def setup_metadata_table(db_path: str) -> None:
-    """Ensure a table exists to track the latest timestamp"""
-    connection = sqlite3.connect(db_path)
-    try:
-        cursor = connection.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS meta (
-                key TEXT PRIMARY KEY,
-                value TEXT
-            )
-        """)
-        connection.commit()
-    finally:
-        connection.close()
+    """Ensure the tables exist to track the latest timestamp and remote file mtimes"""
+    connection = _get_conn(db_path)
+    cursor = connection.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS files_mtime (
+            name TEXT PRIMARY KEY,
+            mtime TEXT
+        )
+    """)
+    connection.commit()
 
 
 def get_last_timestamp(db_path: str) -> Optional[datetime.datetime]:
@@ -25,15 +50,11 @@ def get_last_timestamp(db_path: str) -> Optional[datetime.datetime]:
     The stored format is expected to be 'YYYYMMDDHHMMSS'. If missing or invalid,
     return None.
     """
-    connection = sqlite3.connect(db_path)
-    try:
-        cursor = connection.cursor()
-        cursor.execute(
-            "SELECT value FROM meta WHERE key='last_timestamp'"
-        )
-        row = cursor.fetchone()
-    finally:
-        connection.close()
+    cursor = _get_conn(db_path).cursor()
+    cursor.execute(
+        "SELECT value FROM meta WHERE key='last_timestamp'"
+    )
+    row = cursor.fetchone()
 
     if not row:
         return None
@@ -47,22 +68,109 @@ def get_last_timestamp(db_path: str) -> Optional[datetime.datetime]:
         LOGGER.warning("Invalid last_timestamp format stored in DB: %s", ts_str)
         return None
 
-def set_last_timestamp(db_path: str, timestamp: datetime.datetime) -> None:
+def last_timestamp_meta(timestamp: datetime.datetime) -> Dict[str, str]:
     """
-    Store the last_timestamp as 'YYYYMMDDHHMMSS' in the meta table.
+    Return the meta row storing last_timestamp as 'YYYYMMDDHHMMSS',
+    to be written with set_meta_bulk().
+    """
+    return {"last_timestamp": timestamp.strftime("%Y%m%d%H%M%S")}
+
+
+def set_meta_bulk(db_path: str, items: Dict[str, str]) -> None:
+    """
+    Upsert all (key, value) pairs into the meta table and commit.
+
+    Called every few uploaded files and at the end of each cycle, so the
+    meta updates in between (and any pending files_mtime writes) share one
+    statement and one commit.
+    """
+    connection = _get_conn(db_path)
+    connection.executemany(
+        "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+        items.items(),
+    )
+    connection.commit()
+
+
+def get_file_resume_point(db_path: str, filename: str) -> Tuple[int, Optional[bytes], Optional[int]]:
+    """
+    Return (byte offset, header line, size) saved for a remote file.
+
+    The offset is where the next download should resume; the header is the
+    file's first line, needed to parse a download that starts mid-file;
+    size is the remote size seen at that download, used to tell whether the
+    file is still growing. Returns (0, None, None) if nothing usable is
+    stored; size alone is None for points saved before it was tracked.
     """
-    ts_str = timestamp.strftime("%Y%m%d%H%M%S")
+    cursor = _get_conn(db_path).cursor()
+    cursor.execute(
+        "SELECT key, value FROM meta WHERE key IN (?, ?, ?)",
+        (f"offset:{filename}", f"header:{filename}", f"size:{filename}"),
+    )
+    values = {key.split(":", 1)[0]: value for key, value in cursor.fetchall()}
+
+    if "offset" not in values or "header" not in values:
+        return 0, None, None
 
-    connection = sqlite3.connect(db_path)
     try:
-        cursor = connection.cursor()
-        cursor.execute(
-            """
-            INSERT OR REPLACE INTO meta (key, value)
-            VALUES ('last_timestamp', ?)
-            """,
-            (ts_str,),
-        )
-        connection.commit()
-    finally:
-        connection.close()
+        offset = int(values["offset"])
+        size = int(values["size"]) if "size" in values else None
+    except ValueError:
+        LOGGER.warning("Invalid resume point stored in DB for %s: %s", filename, values)
+        return 0, None, None
+
+    # Header is stored as latin-1 text so arbitrary bytes round-trip
+    return offset, values["header"].encode("latin-1"), size
+
+def file_resume_point_meta(filename: str, offset: int, header: bytes, size: int) -> Dict[str, str]:
+    """
+    Return the meta rows storing the byte offset, header line and size of a
+    remote file, to be written with set_meta_bulk().
+    """
+    return {
+        f"offset:{filename}": str(offset),
+        f"header:{filename}": header.decode("latin-1"),
+        f"size:{filename}": str(size),
+    }
+
+
+def get_cached_mtimes(db_path: str) -> Dict[str, datetime.datetime]:
+    """
+    Return the remote file mtimes cached in the files_mtime table.
+
+    Stored as 'YYYYMMDDHHMMSS'; rows that fail to parse are skipped.
+    """
+    cursor = _get_conn(db_path).cursor()
+    cursor.execute("SELECT name, mtime FROM files_mtime")
+
+    mtimes: Dict[str, datetime.datetime] = {}
+    for name, mtime_str in cursor.fetchall():
+        try:
+            mtimes[name] = datetime.datetime.strptime(mtime_str, "%Y%m%d%H%M%S")
+        except (TypeError, ValueError):
+            LOGGER.warning("Invalid cached mtime for %s: %s", name, mtime_str)
+    return mtimes
+
+def set_cached_mtimes(db_path: str, mtimes: Dict[str, datetime.datetime]) -> None:
+    """
+    Upsert remote file mtimes into the files_mtime table.
+
+    Committed by the next set_meta_bulk().
+    """
+    cursor = _get_conn(db_path).cursor()
+    cursor.executemany(
+        "INSERT OR REPLACE INTO files_mtime (name, mtime) VALUES (?, ?)",
+        [(name, mtime.strftime("%Y%m%d%H%M%S")) for name, mtime in mtimes.items()],
+    )
+
+def delete_cached_mtimes(db_path: str, names: Iterable[str]) -> None:
+    """
+    Forget cached mtimes of files that are gone from the server.
+
+    Committed by the next set_meta_bulk().
+    """
+    cursor = _get_conn(db_path).cursor()
+    cursor.executemany(
+        "DELETE FROM files_mtime WHERE name = ?",
+        [(name,) for name in names],
+    )
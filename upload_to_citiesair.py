@@ -11,17 +11,31 @@ This script:
   as a CSV upload.
 """
 
+import bisect
+import collections
+import csv
 import datetime
+import functools
+import gzip
 import io
 import logging
+import math
 import os
+import queue
+import signal
 import sqlite3
+import threading
 import time
-from ftplib import FTP, all_errors as FTP_ERRORS
-from typing import List, Optional, Tuple
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from ftplib import FTP, all_errors as FTP_ERRORS, error_perm
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
 
-import pandas as pd
+import numpy as np
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from appConfig import (
     API_URL,
@@ -38,7 +52,17 @@ from appConfig import (
 
 from utils import (extract_year_month)
 
-from metadata_table import (setup_metadata_table, get_last_timestamp, set_last_timestamp)
+from metadata_table import (
+    setup_metadata_table,
+    get_last_timestamp,
+    last_timestamp_meta,
+    get_file_resume_point,
+    file_resume_point_meta,
+    get_cached_mtimes,
+    set_cached_mtimes,
+    delete_cached_mtimes,
+    set_meta_bulk,
+)
 
 LOGGER = logging.getLogger("CITESair_uploader")
 logging.basicConfig(
@@ -46,9 +70,67 @@ logging.basicConfig(
     format="%(asctime)s [%(levelname)s] %(message)s",
 )
 
+# Timezone of the naive FIDAS timestamps, and the "+04:00"-style suffix
+# that isoformat() would append for it
+TZ = datetime.timezone(datetime.timedelta(hours=TZ_OFFSET))
+TZ_SUFFIX = datetime.datetime(2000, 1, 1, tzinfo=TZ).isoformat()[19:]
+
+# One HTTP session for the lifetime of the process so uploads reuse the
+# TCP/TLS connection. Only failures where the batch cannot have been stored
+# are retried: connection errors and 503. A 502/504 or read timeout may come
+# after the backend already saved it, and a retry would upload it twice.
+SESSION = requests.Session()
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        max_retries=Retry(
+            total=3,
+            connect=3,
+            read=0,
+            other=0,
+            backoff_factor=0.5,
+            status_forcelist=(503,),
+            allowed_methods=frozenset({"POST"}),
+            raise_on_status=False,
+        )
+    ),
+)
+SESSION.mount("http://", SESSION.get_adapter("https://"))
+
+# Columns read from a FIDAS file: date, time, then the measurements
+REQUIRED_COLUMNS = ["date", "time", "PM1", "PM2.5", "PM10", "rH", "T", "p"]
+
+# Cell values treated as missing measurements (pandas' default na_values,
+# which read_csv applied before parsing moved to the csv module)
+NA_VALUES = frozenset({
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan",
+    "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a",
+    "nan", "null",
+})
+
+# Maximum number of files downloaded concurrently (one FTP connection each)
+FTP_WORKERS = 4
+
+# Finished uploads are committed to the metadata DB every this many files,
+# so a restart mid-cycle only re-uploads the few since the last commit
+META_COMMIT_EVERY = 8
+
 # ---------------------------------------------------------------------------
 # FTP helpers
 # ---------------------------------------------------------------------------
+class FTPClient(FTP):
+    """ftplib.FTP that remembers whether the server accepts MODE Z (deflate)
+    and REST (``restart``), and whether a failed command or transfer may
+    have left an unread reply on the control connection (``broken``). A
+    broken client must not be reused: every later command would read the
+    reply meant for the one before it.
+    """
+
+    deflate = False
+    restart = False
+    broken = False
+
+
 def create_ftp_client() -> Optional[FTP]:
     """Create, connect, and authenticate a plain FTP client.
 
@@ -58,7 +140,7 @@ def create_ftp_client() -> Optional[FTP]:
         your environment (e.g., local/VPN-only traffic).
     """
     try:
-        ftp = FTP()
+        ftp = FTPClient()
         ftp.connect(host=FTP_HOST, port=FTP_PORT, timeout=30)
         ftp.login(user=FTP_USERNAME, passwd=FTP_PASSWORD)
         LOGGER.info(
@@ -85,19 +167,71 @@ def create_ftp_client() -> Optional[FTP]:
                     exc,
                 )
 
+        # Probe deflate transfers once. Listings must stay uncompressed for
+        # ftplib, so MODE Z is only switched on around full-file downloads.
+        try:
+            ftp.voidcmd("MODE Z")
+            ftp.voidcmd("MODE S")
+            ftp.deflate = True
+            LOGGER.info("FTP server supports MODE Z; full downloads will be compressed.")
+        except error_perm:
+            pass
+
+        # Probe REST too: a server that rejects it would fail every resumed
+        # download, so without it files are always fetched in full.
+        try:
+            ftp.sendcmd("REST 0")
+            ftp.restart = True
+        except error_perm:
+            LOGGER.info("FTP server does not support REST; downloads will not be resumed.")
+
         return ftp
     except FTP_ERRORS as exc:
         LOGGER.error("FTP connection or login failed: %s", exc)
         return None
 
-def list_remote_txt_files_with_mtime(ftp: FTP) -> List[Tuple[str, Optional[datetime.datetime]]]:
+def close_ftp_client(ftp: FTP) -> None:
+    """Politely end an FTP session, falling back to a hard close."""
+    try:
+        ftp.quit()
+    except FTP_ERRORS:
+        # Some servers may close the connection early; ignore.
+        try:
+            ftp.close()
+        except FTP_ERRORS:
+            pass
+
+def refresh_ftp_clients(clients: List[FTP]) -> List[FTP]:
     """
-    Return list of (filename, mtime) for .txt files.
+    Return the clients from a previous cycle that are still usable.
+
+    Each one gets a NOOP; servers drop idle sessions, so any client whose
+    NOOP fails is closed and left out.
+    """
+    alive: List[FTP] = []
+    for ftp in clients:
+        if getattr(ftp, "broken", False):
+            # QUIT would only read a stale reply; just drop the sockets
+            ftp.close()
+            continue
+        try:
+            ftp.voidcmd("NOOP")
+            alive.append(ftp)
+        except FTP_ERRORS as exc:
+            LOGGER.info("Dropping stale FTP connection: %s", exc)
+            close_ftp_client(ftp)
+    return alive
+
+def list_remote_txt_files_with_mtime(ftp: FTP) -> List[Tuple[str, datetime.datetime]]:
+    """
+    Return list of (filename, mtime) for .txt files, sorted by mtime.
 
     mtime is a naive datetime parsed from the FTP 'modify' fact (YYYYMMDDHHMMSS).
-    If we can't determine mtime for some file, its mtime is None.
+    Files whose mtime can't be determined are left out (no way to compare
+    them safely against last_timestamp).
     """
-    files: List[Tuple[str, Optional[datetime.datetime]]] = []
+    files: List[Tuple[str, datetime.datetime]] = []
+    skipped: List[str] = []
 
     try:
         # MLSD gives (name, facts) where facts may include 'modify'
@@ -106,15 +240,17 @@ def list_remote_txt_files_with_mtime(ftp: FTP) -> List[Tuple[str, Optional[datet
                 continue
 
             modify = facts.get("modify")
-            if modify:
-                # 'modify' looks like '20251126094512'
-                try:
-                    mtime = datetime.datetime.strptime(modify, "%Y%m%d%H%M%S")
-                except ValueError:
-                    LOGGER.warning("Could not parse modify time '%s' for '%s'", modify, name)
-                    mtime = None
-            else:
-                mtime = None
+            if not modify:
+                skipped.append(name)
+                continue
+
+            # 'modify' looks like '20251126094512'
+            try:
+                mtime = datetime.datetime.strptime(modify, "%Y%m%d%H%M%S")
+            except ValueError:
+                LOGGER.warning("Could not parse modify time '%s' for '%s'", modify, name)
+                skipped.append(name)
+                continue
 
             files.append((name, mtime))
 
@@ -122,131 +258,388 @@ def list_remote_txt_files_with_mtime(ftp: FTP) -> List[Tuple[str, Optional[datet
         # Server doesn't support MLSD; caller can fall back to MDTM version
         LOGGER.warning("MLSD not supported by server: %s", exc)
 
-    return sorted(files, key=lambda t: (t[1] or datetime.datetime.min, t[0]))
+    if skipped:
+        LOGGER.warning("Skipping files without an mtime from FTP: %s", skipped)
+
+    return sorted(files, key=lambda t: (t[1], t[0]))
+
+def fetch_remote_mtime(ftp: FTP, name: str) -> Optional[datetime.datetime]:
+    """Return the mtime of a single remote file via MDTM, or None if unknown."""
+    try:
+        resp = ftp.sendcmd(f"MDTM {name}")
+    except error_perm as exc:
+        LOGGER.warning("MDTM failed for '%s': %s", name, exc)
+        return None
 
-def select_files_to_process(remote_files: List[Tuple[str, Optional[datetime.datetime]]], last_timestamp: Optional[datetime.datetime]) -> List[str]:
+    # Reply looks like '213 20251126094512' (some servers append '.sss')
+    try:
+        return datetime.datetime.strptime(resp[4:18], "%Y%m%d%H%M%S")
+    except ValueError:
+        LOGGER.warning("Could not parse MDTM reply '%s' for '%s'", resp, name)
+        return None
+
+def list_remote_txt_files_cached(ftp: FTP) -> List[Tuple[str, datetime.datetime]]:
+    """
+    Same result as list_remote_txt_files_with_mtime, backed by the
+    files_mtime table so a cycle doesn't need the full MLSD listing.
+
+    Each cycle only fetches names (NLST). MDTM is then sent for names not
+    seen before, names outside the DUSTMONITOR_..._YYYY_MM.txt pattern, and
+    the files of the two most recent months, which are the only ones the
+    FIDAS logger still appends to. Older monthly files keep their cached
+    mtime. With an empty cache, or if NLST fails, MLSD is used instead.
+    """
+    cached = get_cached_mtimes(DB_PATH)
+
+    names: Optional[List[str]] = None
+    if cached:
+        try:
+            names = [n for n in ftp.nlst() if n.lower().endswith(".txt")]
+        except error_perm as exc:
+            LOGGER.warning("NLST failed, falling back to MLSD: %s", exc)
+
+    if names is None:
+        files = list_remote_txt_files_with_mtime(ftp)
+        delete_cached_mtimes(DB_PATH, cached.keys() - {name for name, _ in files})
+        set_cached_mtimes(DB_PATH, dict(files))
+        return files
+
+    recent_months = sorted({ym for ym in map(extract_year_month, names) if ym})[-2:]
+    refreshed: Dict[str, datetime.datetime] = {}
+    for name in names:
+        year_month = extract_year_month(name)
+        if name in cached and year_month is not None and year_month not in recent_months:
+            continue
+        mtime = fetch_remote_mtime(ftp, name)
+        if mtime is not None:
+            refreshed[name] = mtime
+
+    set_cached_mtimes(DB_PATH, refreshed)
+    delete_cached_mtimes(DB_PATH, cached.keys() - set(names))
+
+    files = []
+    for name in names:
+        mtime = refreshed.get(name) or cached.get(name)
+        if mtime is not None:
+            files.append((name, mtime))
+    return sorted(files, key=lambda t: (t[1], t[0]))
+
+def select_files_to_process(remote_files: List[Tuple[str, datetime.datetime]], last_timestamp: Optional[datetime.datetime]) -> List[str]:
     """
-    Given a list of (filename, mtime) returned by list_remote_txt_files_with_mtime,
-    return the list of filenames that should be processed.
-    
+    Given the mtime-sorted list of (filename, mtime) returned by
+    list_remote_txt_files_cached, return the filenames that should be
+    processed, oldest first.
+
     Rules:
       - If last_timestamp is None → process ALL files
-      - If mtime is None → skip the file (no way to compare safely)
       - If mtime > last_timestamp → include
     """
-    files_to_process: List[str] = []
-
-    for filename, mtime in remote_files:
-        if mtime is None:
-            LOGGER.warning(
-                "Skipping '%s' because it has no mtime from FTP.", filename
-            )
-            continue
+    if last_timestamp is None:
+        return [name for name, _ in remote_files]
+
+    start = bisect.bisect_right([mtime for _, mtime in remote_files], last_timestamp)
+    return [name for name, _ in remote_files[start:]]
+
+class FTPRetrStream(io.RawIOBase):
+    """Read-only file object fed by a RETR running in a worker thread.
+
+    Blocks received on the data connection are handed over through a
+    bounded queue, so at most ``max_blocks`` blocks are buffered at any time
+    instead of the whole remote file. Full downloads use MODE Z when the
+    client found the server supports it; resumed downloads are small and
+    not worth the two extra MODE commands.
+
+    The caller must have switched the client to TYPE I (binary) already.
+
+    A trailing line without a newline is passed on at the end of the
+    transfer, unless ``hold_tail`` says the file is still being written, in
+    which case it is dropped. Either way it is left out of
+    ``bytes_complete``, which counts the remote bytes up to the last
+    newline, so ``rest + bytes_complete`` is where the next download can
+    resume. With ``rest`` set, ``header`` is emitted first so the data still
+    parses as a table; otherwise the file's own first line is recorded in
+    ``header``.
+
+    The FTP client must not be used by anyone else until the stream is
+    closed. Closing early drains the rest of the transfer so the control
+    connection is left in a clean state.
+    """
 
-        if last_timestamp is None or mtime > last_timestamp:
-            files_to_process.append(filename)
+    def __init__(
+        self,
+        ftp: FTP,
+        filename: str,
+        rest: Optional[int] = None,
+        header: bytes = b"",
+        hold_tail: bool = False,
+        max_blocks: int = 32,
+    ) -> None:
+        super().__init__()
+        self._blocks: "queue.Queue[bytes]" = queue.Queue(maxsize=max_blocks)
+        self._pending = b""
+        self._tail = b""
+        self._hold_tail = hold_tail
+        self._eof = False
+        self._error: Optional[BaseException] = None
+        self.header = header if rest else b""
+        self.bytes_complete = 0
+        if self.header:
+            self._blocks.put(self.header)
+        self._worker = threading.Thread(
+            target=self._retrieve, args=(ftp, filename, rest), daemon=True
+        )
+        self._worker.start()
+
+    def _retrieve(self, ftp: FTP, filename: str, rest: Optional[int]) -> None:
+        deflate = rest is None and getattr(ftp, "deflate", False)
+        try:
+            if deflate:
+                ftp.voidcmd("MODE Z")
+            inflate = zlib.decompressobj() if deflate else None
+            # Same as retrbinary() minus its TYPE I round trip
+            with ftp.transfercmd(f"RETR {filename}", rest) as conn:
+                while block := conn.recv(8192):
+                    self._on_block(inflate.decompress(block) if inflate else block)
+            if inflate:
+                self._on_block(inflate.flush())
+            if self._tail and not self._hold_tail:
+                self._blocks.put(self._tail)
+            ftp.voidresp()
+            if deflate:
+                ftp.voidcmd("MODE S")
+        except BaseException as exc:
+            # The transfer reply may still be unread (and MODE Z still on),
+            # so no further command is sent; the client is retired instead.
+            ftp.broken = True
+            self._error = exc
+        finally:
+            # Empty block marks end of transfer
+            self._blocks.put(b"")
+
+    def _on_block(self, block: bytes) -> None:
+        data = self._tail + block
+        cut = data.rfind(b"\n") + 1
+        self._tail = data[cut:]
+        if not cut:
+            return
+        if not self.header:
+            self.header = data[:data.find(b"\n") + 1]
+        self.bytes_complete += cut
+        self._blocks.put(data[:cut])
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        if not self._pending and not self._eof:
+            block = self._blocks.get()
+            if not block:
+                self._eof = True
+            self._pending = block
+        if not self._pending:
+            if self._error is not None:
+                raise self._error
+            return 0
+        n = min(len(b), len(self._pending))
+        b[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+    def close(self) -> None:
+        if not self.closed:
+            while not self._eof:
+                if not self._blocks.get():
+                    self._eof = True
+            self._worker.join()
+        super().close()
 
-    # Sort filenames alphabetically for deterministic order
-    files_to_process.sort()
-    return files_to_process
 
 # ---------------------------------------------------------------------------
 # Raw file processing and API upload
 # ---------------------------------------------------------------------------
-def clean(x, transform=None):
-    """
-    Return cleaned value:
-    - If x is NaN → return None
-    - Else apply optional transform(x)
+@functools.lru_cache(maxsize=64)
+def parse_fidas_date(value: str) -> datetime.datetime:
+    """Parse a FIDAS 'MM/DD/YYYY' date; every row of a day repeats it."""
+    return datetime.datetime.strptime(value, "%m/%d/%Y")
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_fidas_time(value: str) -> datetime.timedelta:
+    """Parse a FIDAS 'HH:MM:SS AM' time as an offset from midnight.
+
+    Minute-resolution logs repeat the same 1440 values every day.
     """
-    if pd.isna(x):
-        return None
-    return transform(x) if transform else x
+    t = datetime.datetime.strptime(value, "%I:%M:%S %p")
+    return datetime.timedelta(hours=t.hour, minutes=t.minute, seconds=t.second)
+
+
+def to_float(value: str) -> float:
+    """Convert a measurement cell, mapping NA markers to NaN."""
+    return math.nan if value in NA_VALUES else float(value)
 
 
 def process_raw_file(
     ftp: FTP,
     filename: str,
-    last_timestamp: Optional[datetime.datetime]
-) -> Optional[Tuple[List[dict], datetime.datetime]]:
+    last_timestamp: Optional[datetime.datetime],
+    offset: int = 0,
+    header: Optional[bytes] = None,
+    last_size: Optional[int] = None
+) -> Optional[Tuple[List[dict], Optional[datetime.datetime], Optional[int], bytes, Optional[int]]]:
     """
     Download a remote FIDAS .txt file and convert NEW rows into
     backend measurement JSON objects.
 
+    If ``offset`` and ``header`` from a previous run are given and the
+    file has only grown since, only the bytes past ``offset`` are
+    downloaded (FTP REST), provided the client found the server accepts
+    REST. Otherwise the whole file is fetched.
+
+    A last line without a newline is only skipped while the file is still
+    growing (its size differs from ``last_size``, the size seen when the
+    resume point was saved); otherwise it is a finished row and is parsed.
+
     Returns:
-        A list of measurement dicts, or None if nothing new.
+        (measurements, newest_timestamp, next_offset, header, size), or None
+        if there is neither anything to upload nor a resume point to save.
+        next_offset and size are None when the server can't report the file
+        size, in which case resuming is not attempted. If the file only had
+        rows up to last_timestamp, measurements is empty, newest_timestamp
+        is None and the result just carries the new resume point.
     """
-    buffer = io.BytesIO()
-
-    # -- Fetch file over FTP
+    # --- Decide where to resume from
     try:
-        ftp.retrbinary(f"RETR {filename}", callback=buffer.write)
+        # Listings leave the session in TYPE A; SIZE and RETR need binary
+        ftp.voidcmd("TYPE I")
+        size: Optional[int] = ftp.size(filename)
+    except error_perm as exc:
+        LOGGER.warning("SIZE not available for %s, downloading in full: %s", filename, exc)
+        size = None
     except FTP_ERRORS as exc:
         LOGGER.error("Could not retrieve %s: %s", filename, exc)
+        ftp.broken = True
         return None
 
-    buffer.seek(0)
-
-    # -- Parse file
-    try:
-        df = pd.read_table(buffer)
-    except Exception as exc:
-        LOGGER.error("Failed to parse %s: %s", filename, exc)
-        return None
-    finally:
-        buffer.close()
-
-    if df.empty:
-        LOGGER.info("File %s is empty.", filename)
+    if size is None or header is None or offset > size:
+        # Unknown, first time, or the file was replaced by a shorter one
+        offset = 0
+    elif offset == size:
+        LOGGER.info("No new bytes in %s since offset %d.", filename, offset)
         return None
+    elif not getattr(ftp, "restart", False):
+        # Server rejects REST; fetch it all, last_timestamp filters old rows
+        offset = 0
+
+    timestamps: List[datetime.datetime] = []
+    values: List[Tuple[float, ...]] = []
+    rows_seen = 0
+    bad_timestamps = 0
+
+    # -- Stream the file over FTP and keep only the new rows
+    growing = size is not None and last_size is not None and size != last_size
+    stream = FTPRetrStream(
+        ftp, filename, rest=offset or None, header=header or b"", hold_tail=growing
+    )
+    text = io.TextIOWrapper(io.BufferedReader(stream), encoding="utf-8-sig", newline="")
+    try:
+        rows = csv.reader(text, delimiter="\t")
+        columns = next(rows, None)
+        if columns is None:
+            LOGGER.info("File %s is empty.", filename)
+            return None
 
-    # --- Ensure required columns exist
-    required = ["date", "time", "PM1", "PM2.5", "PM10", "rH", "T", "p"]
-    for col in required:
-        if col not in df.columns:
-            LOGGER.error("Missing required column '%s' in %s", col, filename)
+        # --- Ensure required columns exist
+        missing = set(REQUIRED_COLUMNS) - set(columns)
+        if missing:
+            LOGGER.error("Missing required columns %s in %s", sorted(missing), filename)
             return None
 
-    # --- Construct timestamp column
-    try:
-        df["ts"] = pd.to_datetime(
-            df["date"] + " " + df["time"],
-            format="%m/%d/%Y %I:%M:%S %p"
-        )
+        date_idx, time_idx, *value_idx = [columns.index(col) for col in REQUIRED_COLUMNS]
+        width = max(date_idx, time_idx, *value_idx)
 
+        for row in rows:
+            # Skip blank lines; missing trailing cells count as NA
+            if not row:
+                continue
+            if len(row) <= width:
+                row += [""] * (width + 1 - len(row))
+            rows_seen += 1
+
+            # --- Construct timestamp; rows without a valid one are skipped
+            date, time_of_day = row[date_idx], row[time_idx]
+            if date in NA_VALUES or time_of_day in NA_VALUES:
+                bad_timestamps += 1
+                continue
+            try:
+                ts = parse_fidas_date(date) + parse_fidas_time(time_of_day)
+            except ValueError:
+                bad_timestamps += 1
+                continue
+
+            # --- Filter only new rows
+            if last_timestamp and ts <= last_timestamp:
+                continue
+
+            timestamps.append(ts)
+            values.append(tuple(to_float(row[i]) for i in value_idx))
+    except FTP_ERRORS as exc:
+        LOGGER.error("Could not retrieve %s: %s", filename, exc)
+        ftp.broken = True
+        return None
     except Exception as exc:
-        LOGGER.error("Date parsing error in %s: %s", filename, exc)
+        LOGGER.error("Failed to parse %s: %s", filename, exc)
         return None
+    finally:
+        text.close()
 
-    # --- Filter only new rows
-    if last_timestamp:
-        df = df[df["ts"] > last_timestamp]
+    if bad_timestamps:
+        LOGGER.warning(
+            "Skipped %d rows with a missing or invalid date/time in %s.",
+            bad_timestamps,
+            filename,
+        )
 
-    if df.empty:
-        LOGGER.info("No new rows in %s after last_timestamp.", filename)
+    if rows_seen == 0:
+        if offset:
+            LOGGER.info("No complete new row in %s past offset %d yet.", filename, offset)
+        else:
+            LOGGER.info("File %s has no complete rows.", filename)
         return None
 
+    if not timestamps:
+        LOGGER.info("No new rows in %s after last_timestamp.", filename)
+        if size is None:
+            return None
+        # Nothing to upload, but remember how far the file has been parsed
+        # so the same bytes aren't downloaded again next cycle.
+        return [], None, offset + stream.bytes_complete, stream.header, size
 
-    df = df.sort_values("ts")
+    order = sorted(range(len(timestamps)), key=timestamps.__getitem__)
     # newest naive timestamp (before timezone added)
-    newest_timestamp = df["ts"].iloc[-1]
+    newest_timestamp = timestamps[order[-1]]
 
-    # --- Build measurement objects
-    measurements = []
+    # --- Build measurement objects column-wise; NaN → None via numpy masks
+    pm1, pm25, pm10, rh, temp, pressure = np.array(values, dtype=np.float64)[order].T
+    ts_iso = [timestamps[i].isoformat() + TZ_SUFFIX for i in order]
 
-    for idx, row in df.iterrows():
-        m = {
-            "ts": row["ts"].replace(tzinfo=datetime.timezone(datetime.timedelta(hours=TZ_OFFSET))).isoformat(),
-            "t": clean(row["T"]),
-            "h": clean(row["rH"]),
-            "p": clean(row["p"], lambda v: int(round(v * 100))),
-            "p1": clean(row["PM1"]),
-            "p25": clean(row["PM2.5"]),
-            "p10": clean(row["PM10"])
-        }
-        measurements.append(m)
+    p_scaled = np.round(pressure * 100)
+    p_missing = np.isnan(p_scaled)
+    p_out = np.where(p_missing, None, np.where(p_missing, 0, p_scaled).astype(np.int64)).tolist()
 
-    return measurements, newest_timestamp
+    t_out, h_out, p1_out, p25_out, p10_out = (
+        np.where(np.isnan(col), None, col).tolist()
+        for col in (temp, rh, pm1, pm25, pm10)
+    )
+
+    measurements = [
+        {"ts": ts, "t": t, "h": h, "p": p, "p1": p1, "p25": p25, "p10": p10}
+        for ts, t, h, p, p1, p25, p10 in zip(
+            ts_iso, t_out, h_out, p_out, p1_out, p25_out, p10_out
+        )
+    ]
+
+    next_offset = offset + stream.bytes_complete if size is not None else None
+    return measurements, newest_timestamp, next_offset, stream.header, size
 
 def send_measurements_through_api(measurements: List[dict]) -> bool:
     """
@@ -254,11 +647,18 @@ def send_measurements_through_api(measurements: List[dict]) -> bool:
 
     Returns True on success, False on failure.
     """
+    # JSON compresses well; level 1 keeps the CPU cost negligible
+    body = gzip.compress(orjson.dumps(measurements), compresslevel=1)
+
     try:
-        response = requests.post(
+        response = SESSION.post(
             API_URL,
-            headers=HEADERS,
-            json=measurements,
+            headers={
+                **HEADERS,
+                "Content-Type": "application/json",
+                "Content-Encoding": "gzip",
+            },
+            data=body,
             timeout=30
         )
     except requests.RequestException as exc:
@@ -273,10 +673,196 @@ def send_measurements_through_api(measurements: List[dict]) -> bool:
 
     return True
 
+class UploadWorker:
+    """Background thread that uploads processed files while the main loop
+    fetches and parses the next ones.
+
+    Results are handed over through a bounded queue of ``max_pending``
+    parsed files; submit() blocks while it is full. Together with the files
+    being downloaded (one per FTP client) and the one being submitted, that
+    bounds how many parsed files are held in memory at once. A single thread
+    does all uploads, in submission order, which keeps SESSION use serial.
+    Meta updates for successful uploads are collected and handed back by
+    collect() and drain(), so only the main thread touches the metadata
+    database.
+    """
+
+    def __init__(self, max_pending: int = 4) -> None:
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue(maxsize=max_pending)
+        self._lock = threading.RLock()
+        self._meta: Dict[str, str] = {}
+        # Newest last_timestamp handed out so far, so it never moves back
+        # after collect() has emptied _meta
+        self._newest = ""
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(
+        self,
+        filename: str,
+        measurements: List[dict],
+        newest_timestamp: Optional[datetime.datetime],
+        offset: Optional[int],
+        header: bytes,
+        size: Optional[int]
+    ) -> None:
+        """Queue one process_raw_file result; blocks while the queue is full."""
+        self._queue.put((filename, measurements, newest_timestamp, offset, header, size))
+
+    def collect(self) -> Dict[str, str]:
+        """Return (and reset) the meta updates of the uploads finished so
+        far, without waiting for the rest."""
+        with self._lock:
+            meta, self._meta = self._meta, {}
+        return meta
+
+    def drain(self) -> Dict[str, str]:
+        """Wait for everything submitted so far, then return (and reset)
+        the meta updates it produced."""
+        self._queue.join()
+        return self.collect()
+
+    def close(self) -> None:
+        """Finish queued uploads and stop the thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._upload(*item)
+            except Exception:
+                LOGGER.exception("Unexpected error uploading %s", item[0])
+            finally:
+                self._queue.task_done()
+
+    def _upload(
+        self,
+        filename: str,
+        measurements: List[dict],
+        newest_timestamp: Optional[datetime.datetime],
+        offset: Optional[int],
+        header: bytes,
+        size: Optional[int]
+    ) -> None:
+        if not measurements:
+            # Parsed up to here with nothing new; only move the resume point
+            with self._lock:
+                self._meta.update(file_resume_point_meta(filename, offset, header, size))
+            return
+
+        # --- Send to backend
+        if not send_measurements_through_api(measurements):
+            return
+
+        # --- Update last_timestamp (never backwards) and where to resume this file
+        stamp = last_timestamp_meta(newest_timestamp)
+        with self._lock:
+            # 'YYYYMMDDHHMMSS' strings compare chronologically
+            if offset is not None:
+                self._meta.update(file_resume_point_meta(filename, offset, header, size))
+            if stamp["last_timestamp"] <= self._newest:
+                return
+            self._newest = stamp["last_timestamp"]
+            self._meta.update(stamp)
+
+        LOGGER.info("Updated last_timestamp to %s", newest_timestamp)
+
 # ---------------------------------------------------------------------------
 # Main loop helpers
 # ---------------------------------------------------------------------------
 
+def fetch_files_in_parallel(
+    clients: List[FTP],
+    filenames: List[str],
+    last_timestamp: Optional[datetime.datetime]
+) -> Iterator[
+    Tuple[str, List[dict], Optional[datetime.datetime], Optional[int], bytes, Optional[int]]
+]:
+    """
+    Run process_raw_file for every file on a small thread pool.
+
+    FTP has no multiplexing, so each client works on one file at a time;
+    the next file is only started when a client is free, so at most
+    len(clients) files are being fetched or parsed while the caller handles
+    a result. ``clients`` (at least one) is topped up to
+    min(FTP_WORKERS, len(filenames)) connections; new ones are appended to
+    the list so later cycles reuse them. If extra clients cannot be created
+    the work simply runs on fewer connections. A client left broken by a
+    failed transfer is closed, removed from ``clients`` and replaced if
+    possible; files left over when no client remains wait for next cycle.
+
+    Each file resumes from its stored offset (file_resume_point_meta). The
+    saved points are read up front, on the calling thread, since the
+    metadata connection is shared.
+
+    Yields:
+        (filename, *result) for every non-empty result, in the order of
+        ``filenames`` (oldest mtime first), as soon as it is available.
+    """
+    resume_points = {name: get_file_resume_point(DB_PATH, name) for name in filenames}
+
+    while len(clients) < min(FTP_WORKERS, len(filenames)):
+        extra = create_ftp_client()
+        if extra is None:
+            break
+        clients.append(extra)
+
+    def work(
+        client: FTP, filename: str
+    ) -> Optional[
+        Tuple[List[dict], Optional[datetime.datetime], Optional[int], bytes, Optional[int]]
+    ]:
+        offset, header, last_size = resume_points[filename]
+        LOGGER.info("Processing %s ...", filename)
+        return process_raw_file(
+            ftp=client,
+            filename=filename,
+            last_timestamp=last_timestamp,
+            offset=offset,
+            header=header,
+            last_size=last_size
+        )
+
+    # At most one file in flight per client
+    remaining = iter(filenames)
+    idle = list(clients)
+    in_flight: Deque[Tuple[str, FTP, Future]] = collections.deque()
+
+    with ThreadPoolExecutor(max_workers=len(clients)) as executor:
+        def submit_next() -> None:
+            while idle:
+                filename = next(remaining, None)
+                if filename is None:
+                    return
+                client = idle.pop()
+                in_flight.append((filename, client, executor.submit(work, client, filename)))
+
+        submit_next()
+        while in_flight:
+            filename, client, future = in_flight.popleft()
+            result = future.result()
+            if getattr(client, "broken", False):
+                # Retire it for good and try to put a fresh one in its place
+                clients.remove(client)
+                client.close()
+                client = create_ftp_client()
+                if client is not None:
+                    clients.append(client)
+            if client is not None:
+                idle.append(client)
+            submit_next()
+            if result:
+                yield (filename, *result)
+
+        deferred = list(remaining)
+        if deferred:
+            LOGGER.warning("No FTP connection left; deferring %s to the next cycle.", deferred)
+
+
 def sleep_until_next_run(interval_seconds: int = 60) -> None:
     """Sleep until the next scheduled run.
 
@@ -299,60 +885,71 @@ def sleep_until_next_run(interval_seconds: int = 60) -> None:
 def main() -> None:
     setup_metadata_table(DB_PATH)
 
-    while True:
-        ftp = create_ftp_client()
-        if ftp is None:
-            LOGGER.error(
-                "FTP client could not be created; skipping this cycle and "
-                "will retry after the sleep interval.",
-            )
-        else:
-            try:
-                """Fetch all the available .txt files and filter out the old files"""
-                remote_files = list_remote_txt_files_with_mtime(ftp)
-                last_timestamp = get_last_timestamp(DB_PATH)
-                files_to_process = select_files_to_process(remote_files, last_timestamp)
-
-                if not files_to_process:
-                    LOGGER.info("No updated files found since last timestamp: %s", last_timestamp)
-                else:
-                    LOGGER.info("Files selected for processing: %s", files_to_process)
-
-                for filename in files_to_process:
-                    LOGGER.info("Processing %s ...", filename)
-
-                    result = process_raw_file(
-                        ftp=ftp,
-                        filename=filename,
-                        last_timestamp=last_timestamp
-                    )
-                    if not result:
-                        continue
-
-                    measurements, newest_timestamp = result
+    # FTP sessions are kept open between cycles and only re-created when the
+    # server has dropped them.
+    clients: List[FTP] = []
+    uploader = UploadWorker()
 
-                    # --- Send to backend
-                    ok = send_measurements_through_api(measurements)
-                    if not ok:
-                        continue
+    def handle_sigterm(signum, frame):
+        raise SystemExit(0)
 
-                    # --- Update last_timestamp
-                    set_last_timestamp(DB_PATH, newest_timestamp)
-                    last_timestamp = newest_timestamp
+    signal.signal(signal.SIGTERM, handle_sigterm)
 
-                    LOGGER.info("Updated last_timestamp to %s", newest_timestamp)
-          
-            finally:
+    try:
+        while True:
+            clients = refresh_ftp_clients(clients)
+            if not clients:
+                ftp = create_ftp_client()
+                if ftp is not None:
+                    clients.append(ftp)
+
+            if not clients:
+                LOGGER.error(
+                    "FTP client could not be created; skipping this cycle and "
+                    "will retry after the sleep interval.",
+                )
+            else:
                 try:
-                    ftp.quit()
-                except FTP_ERRORS:
-                    # Some servers may close the connection early; ignore.
-                    try:
-                        ftp.close()
-                    except FTP_ERRORS:
-                        pass
-
-        sleep_until_next_run(interval_seconds=SLEEP_INTERVAL)
+                    """Fetch all the available .txt files and filter out the old files"""
+                    remote_files = list_remote_txt_files_cached(clients[0])
+                    last_timestamp = get_last_timestamp(DB_PATH)
+                    files_to_process = select_files_to_process(remote_files, last_timestamp)
+
+                    if not files_to_process:
+                        LOGGER.info("No updated files found since last timestamp: %s", last_timestamp)
+                    else:
+                        LOGGER.info("Files selected for processing: %s", files_to_process)
+
+                    # Each file is uploaded in the background as soon as it
+                    # is parsed, overlapping with the next downloads.
+                    results = fetch_files_in_parallel(
+                        clients=clients,
+                        filenames=files_to_process,
+                        last_timestamp=last_timestamp
+                    )
+                    for count, result in enumerate(results, start=1):
+                        uploader.submit(*result)
+                        if count % META_COMMIT_EVERY == 0:
+                            # Persist what is uploaded so far, not only at
+                            # the end of a possibly long cycle
+                            set_meta_bulk(DB_PATH, uploader.collect())
+
+                except FTP_ERRORS as exc:
+                    LOGGER.error("FTP error during cycle, reconnecting next cycle: %s", exc)
+                    for ftp in clients:
+                        close_ftp_client(ftp)
+                    clients = []
+
+                finally:
+                    # Wait for this cycle's remaining uploads, then persist
+                    # their meta updates, also when the cycle is interrupted.
+                    set_meta_bulk(DB_PATH, uploader.drain())
+
+            sleep_until_next_run(interval_seconds=SLEEP_INTERVAL)
+    finally:
+        uploader.close()
+        for ftp in clients:
+            close_ftp_client(ftp)
 
 if __name__ == "__main__":
     main()
@@ -1,15 +1,19 @@
+import functools
 import re
 from typing import Optional, Tuple
-import os
 
 FILENAME_RE = re.compile(
-    r"^DUSTMONITOR_\d+_(\d{4})_(\d{2})\.txt$", re.IGNORECASE
+    r"^DUSTMONITOR_\d+_(\d{4})_(\d{2})\.txt$", re.IGNORECASE | re.ASCII
 )
 
+@functools.lru_cache(maxsize=1024)
 def extract_year_month(filename: str) -> Optional[Tuple[int, int]]:
-    """Extract (year, month) from DUSTMONITOR_..._YYYY_MM.txt filenames."""
-    m = FILENAME_RE.match(os.path.basename(filename))
+    """Extract (year, month) from DUSTMONITOR_..._YYYY_MM.txt filenames.
+
+    ``filename`` must be a bare name as returned by the FTP listing, not a path.
+    """
+    m = FILENAME_RE.match(filename)
     if not m:
         return None
     year, month = int(m.group(1)), int(m.group(2))
-    return year, month
\ No newline at end of file
+    return year, month